@@ -1,56 +1,491 @@
 # app.py
-import json
-import glob
 import os
+import re
+import atexit
 import asyncio
+import contextlib
+import functools
+import gzip
+import importlib.util
+import itertools
+import threading
+import time
 from pathlib import Path
 from datetime import datetime, timedelta
 
-from flask import Flask, jsonify, request, Response, render_template_string
+from flask import Flask, jsonify, request, Response, render_template_string, send_from_directory
+from flask.json.provider import DefaultJSONProvider
+import requests
 from rapidfuzz import process, fuzz
-from utils.normalize import compute_unit_price
+from utils import jsonio
+from utils.chromium import find_chromium_executable as _find_chromium_executable
+from utils.blocking import (BLOCKED_RESOURCE_TYPES as _BLOCKED_RESOURCE_TYPES,
+                            SCREENSHOT_BLOCKED_RESOURCE_TYPES as _SCREENSHOT_BLOCKED_RESOURCE_TYPES,
+                            resource_blocker as _resource_blocker)
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """
+    Route jsonify / dict responses through orjson (stdlib fallback in utils.jsonio).
+    sort_keys (app.json.sort_keys, on by default as in Flask) is honoured;
+    output is always compact UTF-8, so indent/compact/ensure_ascii are ignored.
+    """
+
+    def dumps(self, obj, **kwargs):
+        sort_keys = kwargs.get("sort_keys", self.sort_keys)
+        return jsonio.dumps(obj, default=self.default, sort_keys=sort_keys).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return jsonio.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = jsonio.dumps(obj, default=self.default, sort_keys=self.sort_keys)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
+# Behind nginx/Apache with X-Sendfile enabled, let the proxy stream debug
+# files instead of the worker (send_from_directory honours this).
+app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE") == "1"
 DATA_DIR = Path(__file__).parent / "data"
+# Deals files merged by /deals, /search and /compare, in merge order.
+DEAL_FILES = ("deals_sample_24503.json", "deals_foodlion.json", "deals_freshmarket.json", "deals_walmart.json")
+
+# Parsed JSON files keyed by path -> ((mtime_ns, size), obj).
+# Data files only change when a scraper rewrites them, so most requests
+# can skip the read + parse entirely.
+_JSON_CACHE: dict = {}
+# Raw bytes of JSON files served as-is, same keying as _JSON_CACHE.
+_JSON_BYTES_CACHE: dict = {}
+# Deals files with unit_price computed, same keying as _JSON_CACHE.
+_DEALS_CACHE: dict = {}
+# /compare lookup structures over the merged deals -> {"cur": index dict}
+# (see _compare_index). Each version is built aside and published with one
+# assignment, never mutated in place, so readers always see a whole index.
+_COMPARE_INDEX: dict = {}
+# Encoded /deals body -> {"cur": (sources key, bytes)} (see _deals_body).
+_DEALS_BODY: dict = {}
+# Per-file encoded array contents (no brackets), path -> (signature, bytes).
+_DEALS_FRAGMENTS: dict = {}
+# Gzipped copies of cached JSON bodies, name -> (body, gzipped body); the
+# body is compared by identity, so it is only recompressed when it changes.
+_GZIP_CACHE: dict = {}
+# Bodies smaller than this aren't worth compressing.
+_GZIP_MIN_BYTES = 1024
+
+# Embedded JSON in Fresh Market page HTML (ld+json blocks, Next/Nuxt state).
+_LD_JSON_RE = re.compile(r'<script[^>]+type=["\']application/ld\+json["\'][^>]*>(.*?)</script>', re.S | re.I)
+_NEXT_DATA_RE = re.compile(r'>(?:window\.__NEXT_DATA__|window\.__NUXT__)\s*=\s*(\{.*?\});?\s*<', re.S)
+# Next.js proper ships its page state as <script id="__NEXT_DATA__" type="application/json">.
+_NEXT_DATA_SCRIPT_RE = re.compile(r'<script[^>]+id=["\']__NEXT_DATA__["\'][^>]*>(.*?)</script>', re.S | re.I)
+# Network responses worth keeping during the Fresh Market scrape; analytics,
+# consent and ad beacons never carry products, so they are not even read.
+_FM_PRODUCT_URL_RE = re.compile(r"/_next/data/|graphql|/api/|product|offer|weekly|feature", re.I)
+_FM_CAPTURE_MAX_BYTES = 50_000_000
+# Capture-time check that a body is a JSON object/array: only its first
+# and last non-blank bytes are looked at (so HTML error pages and cut-off
+# bodies are turned away); the full parse happens once, off the loop.
+_JSON_START_RE = re.compile(rb"\s*[\[{]")
+_FM_CAPTURE_MAX_COUNT = 200
+# Keys the captured-JSON walk reads, in priority order (first truthy wins
+# for name/size; every present price is tried).
+_FM_NAME_KEYS = ("name", "title", "headline", "productName", "description",
+                 "primaryText", "tileHeadline", "eyebrow")
+_FM_PRICE_KEYS = ("price", "salePrice", "sale_price", "priceValue", "priceText", "formattedPrice",
+                  "amount", "value", "regularPrice", "finalPrice", "wasPrice", "nowPrice",
+                  "currentPrice", "pricePerPound", "price_per", "tilePrice", "priceString")
+_FM_NESTED_PRICE_KEYS = ("amount", "value", "current", "sale")
+_FM_TEXT_KEYS = ("copy", "body", "text", "subtitle", "blurb", "richText", "html", "content",
+                 "secondaryText", "tileSubheadline", "tileCopy")
+_FM_SIZE_KEYS = ("unit", "uom", "size", "sizeText", "unitOfMeasure", "unitText", "priceUnit")
+# Captured payloads are walked at most this deep (real tiles sit well above it).
+_FM_WALK_MAX_DEPTH = 64
+
+# Price strings seen in Fresh Market payloads: '2 for $5' / '2/$5', '$5.99'
+_MONEY_MULTI_RE = re.compile(r"(\d+)\s*(?:for|/)\s*\$?\s*([0-9]+(?:\.[0-9]{1,2})?)", re.I)
+_MONEY_RE = re.compile(r"\$?\s*([0-9]+(?:\.[0-9]{1,2})?)")
+
+# The Fresh Market page is server-rendered with its state embedded, so a
+# plain GET is tried first; the browser only runs when that yields nothing.
+_FM_HTTP_TIMEOUT = 15
+# requests.Session isn't guaranteed thread-safe, so each to_thread worker
+# keeps its own (still keep-alive across that worker's calls).
+_HTTP_LOCAL = threading.local()
+
+# Installed once per context with add_init_script; pages then just call it.
+# __softScrollDone flips when a pass reaches the bottom.
+_SOFT_SCROLL_JS = """
+window.__softScroll = async () => {
+  window.__softScrollDone = false;
+  const sleep = ms => new Promise(r => setTimeout(r, ms));
+  for (let y = 0; y <= document.body.scrollHeight; y += 800) {
+    window.scrollTo(0, y);
+    await sleep(200);
+  }
+  window.scrollTo(0, document.body.scrollHeight);
+  window.__softScrollDone = true;
+};
+"""
+# Longest wait for a soft-scroll pass before the page is read anyway.
+_SOFT_SCROLL_WAIT_MS = 1200
 
 # -------------------- helpers --------------------
 def load_json(path: Path):
-    with path.open("r", encoding="utf-8") as f:
-        return json.load(f)
-
-def _find_chromium_executable():
-    # Prefer build-installed path; fall back to default cache.
-    for base in ("/opt/render/project/src/.playwright", "/opt/render/.cache/ms-playwright"):
-        hits = sorted(glob.glob(os.path.join(base, "chromium-*", "chrome-linux", "chrome")))
-        if hits:
-            return hits[-1]
-    return None
-
-def _load_all_deals():
     """
-    Merge all present deals files and compute unit_price when possible.
-    Includes walmart file if you add it later.
+    Load a JSON file, reusing the parsed object while the file is unchanged.
+    Callers must treat the result as read-only (copy before mutating).
+    """
+    st = path.stat()
+    sig = (st.st_mtime_ns, st.st_size)
+    hit = _JSON_CACHE.get(path)
+    if hit is not None and hit[0] == sig:
+        return hit[1]
+    obj = jsonio.loads(path.read_bytes())
+    _JSON_CACHE[path] = (sig, obj)
+    return obj
+
+def _json_bytes(path: Path):
+    """
+    Raw bytes of a JSON file for responses that serve it unchanged, cached
+    like load_json. Parsed once per version so a broken file still errors.
     """
-    merged = []
-    for fname in ("deals_sample_24503.json", "deals_foodlion.json", "deals_freshmarket.json", "deals_walmart.json"):
+    st = path.stat()
+    sig = (st.st_mtime_ns, st.st_size)
+    hit = _JSON_BYTES_CACHE.get(path)
+    if hit is not None and hit[0] == sig:
+        return hit[1]
+    raw = path.read_bytes()
+    jsonio.loads(raw)
+    _JSON_BYTES_CACHE[path] = (sig, raw)
+    return raw
+
+def _load_deals_cached(path: Path):
+    """
+    Load one deals file with unit_price already computed -> (signature, deals).
+    The annotated list is cached per file version, so the float work runs
+    once per scrape instead of once per request.
+    """
+    st = path.stat()
+    sig = (st.st_mtime_ns, st.st_size)
+    hit = _DEALS_CACHE.get(path)
+    if hit is not None and hit[0] == sig:
+        return hit
+
+    _float, _round = float, round
+    deals = []
+    append = deals.append
+    for src in load_json(path):
+        d = dict(src)  # never write into the parsed load_json object
+        qty = d.get("unit_qty")
+        price = d.get("price")
+        if qty and price:
+            try:
+                q = _float(qty)
+                if q > 0:
+                    d["unit_price"] = _round(_float(price) / q, 4)
+                else:
+                    d.setdefault("unit_price", None)
+            except (TypeError, ValueError):
+                d["unit_price"] = None
+        else:
+            # most scraped deals carry no unit_qty; skip the try block entirely
+            d.setdefault("unit_price", None)
+        append(d)
+    hit = (sig, deals)
+    # return the local tuple: a scrape may clear the cache from the
+    # Playwright loop thread right after this store
+    _DEALS_CACHE[path] = hit
+    return hit
+
+def _deal_sources():
+    """[(path, signature, deals)] for every present deals file, in merge order."""
+    sources = []
+    for fname in DEAL_FILES:
         p = DATA_DIR / fname
         if p.exists() and p.stat().st_size > 0:
             try:
-                merged.extend(load_json(p))
+                sig, deals = _load_deals_cached(p)
             except Exception:
-                pass
+                continue
+            sources.append((p, sig, deals))
+    return sources
 
-    for d in merged:
-        qty = d.get("unit_qty")
-        price = d.get("price")
+def _load_all_deals():
+    """
+    Merge all present deals files (unit_price precomputed per file).
+    Includes walmart file if you add it later.
+    Returned dicts are shared with the cache; copy before mutating.
+    """
+    return list(itertools.chain.from_iterable(deals for _p, _sig, deals in _deal_sources()))
+
+def _deals_body():
+    """
+    The /deals JSON as bytes. Merging and encoding only happen again when
+    one of the deals files changes; otherwise the last body is reused.
+    """
+    sources = _deal_sources()
+    key = tuple((p, sig) for p, sig, _deals in sources)
+    hit = _DEALS_BODY.get("cur")
+    if hit is not None and hit[0] == key:
+        return hit[1]
+    # Encode per file and splice the arrays, so a scrape that rewrites one
+    # file only re-encodes that file; no merged list is ever built.
+    parts = []
+    for p, sig, deals in sources:
+        frag = _DEALS_FRAGMENTS.get(p)
+        if frag is None or frag[0] != sig:
+            # keys ordered like jsonify's, which served /deals before
+            frag = (sig, jsonio.dumps(deals, sort_keys=app.json.sort_keys)[1:-1])
+            _DEALS_FRAGMENTS[p] = frag
+        if frag[1]:
+            parts.append(frag[1])
+    body = b"[" + b",".join(parts) + b"]"
+    _DEALS_BODY["cur"] = (key, body)
+    return body
+
+def _invalidate_deals_caches():
+    """
+    Forget cached deals state after a scrape rewrites its file. Signatures
+    usually catch that on their own, but a rewrite inside the filesystem's
+    mtime granularity with the same size would otherwise go unnoticed.
+    """
+    for cache in (_JSON_CACHE, _DEALS_CACHE, _DEALS_FRAGMENTS):
+        cache.clear()
+    _DEALS_BODY.pop("cur", None)
+    # in-flight /compare requests keep their own snapshot of the old index;
+    # the next call builds a new one
+    _COMPARE_INDEX.pop("cur", None)
+
+def _cached_json_response(name, body):
+    """
+    application/json Response for an already-encoded, cached body, gzipped
+    (once per body version) when the client accepts it.
+    """
+    if len(body) < _GZIP_MIN_BYTES or not request.accept_encodings["gzip"]:
+        resp = Response(body, mimetype="application/json")
+    else:
+        hit = _GZIP_CACHE.get(name)
+        if hit is None or hit[0] is not body:
+            hit = (body, gzip.compress(body, compresslevel=6, mtime=0))
+            _GZIP_CACHE[name] = hit
+        resp = Response(hit[1], mimetype="application/json")
+        resp.headers["Content-Encoding"] = "gzip"
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+def _trigrams(s: str):
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+def _deal_rank(d):
+    """/compare preference: lowest unit price (unknown last), then lowest price."""
+    up = d.get("unit_price")
+    return (up if up is not None else 9e9, d["price"])
+
+def _compare_index():
+    """
+    Lowercased item names plus a trigram -> deal-index posting map over the
+    merged deals (ordered by _deal_rank), rebuilt only when one of the
+    deals files changes. Callers take the returned dict once per request and
+    use only it, so all lookups (and the picks memo) share one version.
+    """
+    sources = _deal_sources()
+    key = tuple((p, sig) for p, sig, _deals in sources)
+    cur = _COMPARE_INDEX.get("cur")
+    if cur is not None and cur["key"] == key:
+        return cur
+
+    deals = list(itertools.chain.from_iterable(deals for _p, _sig, deals in sources))
+    # Store deals best-first so the lowest matching index is the pick.
+    # sorted() is stable, so ties keep merge order, same as min() would.
+    # sorted() into a new list: list.sort() can leave the list part-permuted
+    # when a key raises, and the per-query fallback needs merge order.
+    try:
+        deals = sorted(deals, key=_deal_rank)
+        ranked = True
+    except (KeyError, TypeError):  # odd rows (no/str price): rank per query instead
+        ranked = False
+    items_lower = [(d.get("item") or "").lower() for d in deals]
+    tri = {}
+    for i, name in enumerate(items_lower):
+        for g in _trigrams(name):
+            tri.setdefault(g, set()).add(i)
+
+    index = {
+        "key": key,
+        "deals": deals,
+        "ranked": ranked,
+        "items_lower": items_lower,
+        "stores_lower": [(d.get("store_id") or "").lower() for d in deals],
+        "tri": tri,
+        "picks": {},
+    }
+    _COMPARE_INDEX["cur"] = index
+    return index
+
+def _match_ids(index, w: str):
+    """Indices (ascending) of deals whose lowercased item contains w."""
+    items_lower = index["items_lower"]
+    if len(w) < 3:
+        return [i for i, name in enumerate(items_lower) if w in name]
+    postings = []
+    for g in _trigrams(w):
+        ids = index["tri"].get(g)
+        if not ids:
+            return []
+        postings.append(ids)
+    postings.sort(key=len)
+    ids = set.intersection(*postings)
+    # trigrams only narrow the set; confirm the real substring match
+    return sorted(i for i in ids if w in items_lower[i])
+
+def _parse_money_any(val):
+    """
+    Accept numbers, '$5.99', '2 for $5', '2/$5', etc. ('99¢' reads as 99).
+    Returns float or None.
+    """
+    if val is None:
+        return None
+    if isinstance(val, (int, float)):
         try:
-            if qty and price and float(qty) > 0:
-                d["unit_price"] = round(float(price) / float(qty), 4)
-            else:
-                d.setdefault("unit_price", None)
+            return float(val)
         except Exception:
-            d["unit_price"] = None
-    return merged
+            return None
+
+    if isinstance(val, str):
+        return _parse_money_text(val)
+    # containers etc.: their str() is one-off, keep it out of the cache
+    return _parse_money_text.__wrapped__(str(val))
+
+# Ad JSON repeats the same few price strings ("$2.99", "2/$5") across tiles,
+# so parses are memoised on the string.
+@functools.lru_cache(maxsize=2048)
+def _parse_money_text(s):
+    # No nbsp/strip normalisation: \s already matches U+00A0 and search()
+    # skips surrounding whitespace.
+
+    # 2 for $5 / 2/$5 -- only worth a regex pass when a separator is present
+    if "/" in s or "for" in s.lower():
+        m = _MONEY_MULTI_RE.search(s)
+        if m:
+            qty = int(m.group(1))
+            total = float(m.group(2))
+            if qty > 0:
+                return round(total / qty, 2)
+
+    # $5.99 / 5.99 (any digit run matches, so this is also the last resort)
+    m = _MONEY_RE.search(s)
+    if m:
+        return float(m.group(1))
+    return None
+
+def _fm_price_candidates(get):
+    """Price candidates of one Fresh Market JSON node, best first, produced lazily."""
+    # explicit price fields
+    for k in _FM_PRICE_KEYS:
+        yield get(k)
+    # nested price object
+    p = get("price")
+    if isinstance(p, dict):
+        for k in _FM_NESTED_PRICE_KEYS:
+            yield p.get(k)
+    # prices written into text-y fields, common in marketing tiles
+    for k in _FM_TEXT_KEYS:
+        yield _parse_money_any(get(k))
+
+# -------------------- shared browser --------------------
+# Playwright lives on one background event loop; scrape routes submit
+# coroutines to it and reuse a single Chromium, opening a fresh context
+# per scrape instead of launching a browser every time.
+_CHROMIUM_ARGS = ["--disable-blink-features=AutomationControlled", "--no-sandbox", "--disable-dev-shm-usage"]
+_PW_LOOP = None
+_PW_LOOP_LOCK = threading.Lock()
+_PW = None
+_BROWSER = None
+_BROWSER_LOCK = None  # asyncio.Lock, created on the Playwright loop
+# Upper bound for one request's Playwright work; stays below gunicorn's timeout.
+_PW_TIMEOUT = 150
+# Concurrent scrape contexts per process (see _scrape_context).
+_MAX_CONTEXTS = int(os.environ.get("SCRAPE_MAX_CONTEXTS", "2"))
+_CONTEXT_SLOTS = None  # asyncio.Semaphore, created on the Playwright loop
+
+def _pw_loop():
+    global _PW_LOOP
+    with _PW_LOOP_LOCK:
+        if _PW_LOOP is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="playwright-loop", daemon=True).start()
+            _PW_LOOP = loop
+    return _PW_LOOP
+
+def _run_on_pw_loop(coro, timeout=_PW_TIMEOUT):
+    """
+    Run a coroutine on the shared Playwright loop and block until it finishes.
+    On timeout the task is cancelled (its finally blocks close the context)
+    and TimeoutError propagates to the route.
+    """
+    fut = asyncio.run_coroutine_threadsafe(coro, _pw_loop())
+    try:
+        return fut.result(timeout=timeout)
+    except TimeoutError:
+        fut.cancel()
+        raise
+
+async def _get_browser(chromium_path):
+    """Shared Chromium, launched on first use and relaunched if it went away."""
+    global _PW, _BROWSER, _BROWSER_LOCK
+    if _BROWSER_LOCK is None:
+        _BROWSER_LOCK = asyncio.Lock()
+    async with _BROWSER_LOCK:
+        if _BROWSER is None or not _BROWSER.is_connected():
+            if _PW is None:
+                from playwright.async_api import async_playwright
+                _PW = await async_playwright().start()
+            _BROWSER = await _PW.chromium.launch(
+                headless=True, executable_path=chromium_path, args=_CHROMIUM_ARGS,
+            )
+    return _BROWSER
+
+@contextlib.asynccontextmanager
+async def _scrape_context(chromium_path, blocked_types=_BLOCKED_RESOURCE_TYPES, use_slot=True, **ctx_kwargs):
+    """
+    Fresh context on the shared browser with heavy resources blocked, closed
+    on exit. At most _MAX_CONTEXTS are open at once so parallel scrapes can't
+    pile tabs into one Chromium; use_slot=False skips that queue (for short
+    one-page checks that mustn't wait behind scrapes).
+    """
+    global _CONTEXT_SLOTS
+    if _CONTEXT_SLOTS is None:
+        _CONTEXT_SLOTS = asyncio.Semaphore(_MAX_CONTEXTS)
+    async with (_CONTEXT_SLOTS if use_slot else contextlib.nullcontext()):
+        browser = await _get_browser(chromium_path)
+        ctx = await browser.new_context(**ctx_kwargs)
+        try:
+            await ctx.route("**/*", _resource_blocker(blocked_types))
+            yield ctx
+        finally:
+            await ctx.close()
+
+async def _close_browser():
+    global _PW, _BROWSER
+    if _BROWSER is not None:
+        await _BROWSER.close()
+        _BROWSER = None
+    if _PW is not None:
+        await _PW.stop()
+        _PW = None
+
+def _shutdown_playwright():
+    """atexit: close the shared Chromium so worker restarts don't leave it orphaned."""
+    if _PW_LOOP is None:
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(_close_browser(), _PW_LOOP).result(timeout=10)
+    except Exception:
+        pass
+
+atexit.register(_shutdown_playwright)
 
 # -------------------- index / simple landing --------------------
 @app.get("/")
@@ -88,6 +523,7 @@ def index():
         <ul>
           <li><code>POST /scrape/foodlion</code></li>
           <li><code>POST /scrape/freshmarket</code></li>
+          <li><code>POST /scrape/all</code> (both, concurrently)</li>
           <!-- Add Walmart later: POST /scrape/walmart -->
         </ul>
       </body>
@@ -100,51 +536,72 @@ def index():
 def debug_foodlion_page():
     p = DATA_DIR / "debug_foodlion.html"
     if not p.exists():
-        return {"ok": False, "error": "No debug HTML found yet. Run /scrape/foodlion first."}, 404
-    return Response(p.read_text(encoding="utf-8", errors="ignore"), mimetype="text/html")
+        return {"ok": False, "error": "No debug HTML found yet. Run /scrape/foodlion?debug=1 first."}, 404
+    return send_from_directory(DATA_DIR, p.name, mimetype="text/html", conditional=True)
 
 @app.get("/debug/freshmarket")
 def debug_freshmarket_page():
     p = DATA_DIR / "debug_freshmarket.html"
     if not p.exists():
-        return {"ok": False, "error": "No Fresh Market debug HTML yet. Run /scrape/freshmarket first."}, 404
-    return Response(p.read_text(encoding="utf-8", errors="ignore"), mimetype="text/html")
+        return {"ok": False, "error": "No Fresh Market debug HTML yet. Run /scrape/freshmarket?debug=1 first."}, 404
+    return send_from_directory(DATA_DIR, p.name, mimetype="text/html", conditional=True)
 
 @app.get("/debug/freshmarket.png")
 def debug_freshmarket_png():
     p = DATA_DIR / "debug_freshmarket.png"
     if not p.exists():
-        return {"ok": False, "error": "No Fresh Market screenshot yet. Run /scrape/freshmarket first."}, 404
-    return Response(p.read_bytes(), mimetype="image/png")
+        return {"ok": False, "error": "No Fresh Market screenshot yet. Run /scrape/freshmarket?screenshot=1 first."}, 404
+    return send_from_directory(DATA_DIR, p.name, mimetype="image/png", conditional=True)
 
 # Summarize captured network JSON (first 25 items)
 @app.get("/debug/freshmarket_captured")
 def debug_freshmarket_captured():
-    p = DATA_DIR / "freshmarket_responses.json"
+    p = DATA_DIR / "freshmarket_responses.jsonl"
     if not p.exists():
-        return {"ok": False, "error": "No captured JSON yet. Run /scrape/freshmarket first."}, 404
+        return {"ok": False, "error": "No captured JSON yet. Run /scrape/freshmarket?debug=1 first."}, 404
+
+    # one response per line: only the summarised lines are parsed, the rest
+    # are just counted
+    summary = []
+    count = 0
     try:
-        blobs = json.loads(p.read_text(encoding="utf-8"))
+        with p.open("rb") as f:
+            for line in f:
+                count += 1
+                if len(summary) >= 25:
+                    continue
+                b = jsonio.loads(line)
+                data = b.get("data")
+                top_type = type(data).__name__
+                top_keys = list(data.keys())[:10] if isinstance(data, dict) else None
+                summary.append({
+                    "url": b.get("url"),
+                    "type": top_type,
+                    "top_keys": top_keys,
+                })
     except Exception as e:
         return {"ok": False, "error": f"read/parse error: {e}"}, 500
-
-    summary = []
-    for b in blobs[:25]:
-        data = b.get("data")
-        top_type = type(data).__name__
-        top_keys = list(data.keys())[:10] if isinstance(data, dict) else None
-        summary.append({
-            "url": b.get("url"),
-            "type": top_type,
-            "top_keys": top_keys,
-        })
-    return {"ok": True, "count": len(blobs), "summary": summary}
+    return {"ok": True, "count": count, "summary": summary}
 
 # -------------------- debug: playwright sanity --------------------
+# Last passing probe, reused for _PROBE_TTL seconds so monitors polling the
+# endpoint don't open a page each time (?force=1 re-runs it).
+_PROBE_TTL = 60
+# The probe is one example.com page, so it gets far less than a scrape.
+_PROBE_TIMEOUT = 30
+_PROBE_CACHE = {"ts": 0.0, "result": None}
+
 @app.get("/debug/playwright")
 def debug_playwright():
+    hit = _PROBE_CACHE["result"]
+    if (hit is not None and request.args.get("force") != "1"
+            and time.monotonic() - _PROBE_CACHE["ts"] < _PROBE_TTL):
+        return hit
+
+    # surface a missing install as "where: import" (located, not imported)
     try:
-        from playwright.async_api import async_playwright
+        if importlib.util.find_spec("playwright.async_api") is None:
+            raise ModuleNotFoundError("No module named 'playwright.async_api'")
     except Exception as e:
         return {"ok": False, "where": "import", "error": str(e)}, 500
 
@@ -152,19 +609,21 @@ def debug_playwright():
         chromium_path = _find_chromium_executable()
         if not chromium_path:
             return {"ok": False, "where": "resolve", "error": "Chromium not found in expected paths."}
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True, executable_path=chromium_path)
-            ctx = await browser.new_context()
+        # same shared browser the scrapes use, so a passing probe also warms
+        # it up; it skips the context slots so running scrapes can't stall it
+        async with _scrape_context(chromium_path, use_slot=False) as ctx:
             page = await ctx.new_page()
             await page.goto("https://example.com", timeout=20000)
             html = await page.content()
-            await ctx.close(); await browser.close()
-            return {"ok": True, "html_len": len(html), "chromium_path": chromium_path}
+        return {"ok": True, "html_len": len(html), "chromium_path": chromium_path}
 
     try:
-        return asyncio.run(probe())
+        result = _run_on_pw_loop(probe(), timeout=_PROBE_TIMEOUT)
     except Exception as e:
-        return {"ok": False, "where": "run", "error": str(e)}, 500
+        return {"ok": False, "where": "run", "error": str(e) or type(e).__name__}, 500
+    if result.get("ok"):
+        _PROBE_CACHE.update(ts=time.monotonic(), result=result)
+    return result
 
 # -------------------- basics --------------------
 @app.get("/health")
@@ -191,14 +650,16 @@ def list_data_files():
 def stores():
     """Return stores by zip (defaults to 24503)."""
     zip_code = request.args.get("zip", "24503")
-    stores = load_json(DATA_DIR / "stores_24503.json")
-    return jsonify([s for s in stores if s["zip"] == zip_code or zip_code == "24503"])
+    path = DATA_DIR / "stores_24503.json"
+    if zip_code == "24503":  # the default zip lists every store: serve the file as-is
+        return _cached_json_response("stores", _json_bytes(path))
+    return jsonify([s for s in load_json(path) if s["zip"] == zip_code])
 
 @app.get("/deals")
 def deals():
     """Return all known deals (sample + any scraped files present)."""
     _ = request.args.get("zip", "24503")  # reserved for future filter
-    return jsonify(_load_all_deals())
+    return _cached_json_response("deals", _deals_body())
 
 @app.get("/search")
 def search_deals():
@@ -251,32 +712,47 @@ def compare():
     wanted = [x.strip().lower() for x in items_q.split(",") if x.strip()]
 
     store_f = (request.args.get("store") or "").strip().lower()
-    deals_all = _load_all_deals()
-    if store_f:
-        deals_all = [d for d in deals_all if store_f in (d.get("store_id") or "").lower()]
-
-    # compute unit_price if not present
-    for d in deals_all:
-        if d.get("unit_price") is None:
-            d["unit_price"] = compute_unit_price(d.get("price"), d.get("unit_qty"))
+    # one snapshot for the whole request: deals, trigram map and memo
+    # always belong to the same catalog version
+    index = _compare_index()
+    deals_all = index["deals"]
+    stores_lower = index["stores_lower"]
+
+    # (term, store filter) -> best deal index or None, per catalog version;
+    # shopping lists repeat the same terms, so most lookups end here.
+    memo = index["picks"]
+    if len(memo) > 4096:
+        memo.clear()
 
     picks = []
     for w in wanted:
-        candidates = [d for d in deals_all if w in (d.get("item", "").lower())]
-        if candidates:
-            best = sorted(
-                candidates,
-                key=lambda x: (x.get("unit_price") if x.get("unit_price") is not None else 9e9, x["price"])
-            )[0]
-            picks.append(best)
-
-    total_cost = sum([p["price"] for p in picks]) if picks else 0.0
-    store_breakdown = {}
+        mk = (w, store_f)
+        if mk in memo:
+            best_i = memo[mk]
+        else:
+            ids = _match_ids(index, w)
+            if store_f:
+                ids = [i for i in ids if store_f in stores_lower[i]]
+            if not ids:
+                best_i = None
+            elif index["ranked"]:
+                best_i = ids[0]
+            else:
+                # min() keeps the first of equal keys, same as sorted(...)[0]
+                best_i = min(ids, key=lambda i: _deal_rank(deals_all[i]))
+            memo[mk] = best_i
+        if best_i is not None:
+            picks.append(deals_all[best_i])
+
+    total_cost = sum((p["price"] for p in picks), 0.0)
+    # group first, then one sum per store (rounded like estimated_total)
+    by_store = {}
     for p in picks:
-        sid = p["store_id"]
-        store_breakdown.setdefault(sid, {"items": [], "subtotal": 0.0})
-        store_breakdown[sid]["items"].append(p["item"])
-        store_breakdown[sid]["subtotal"] += p["price"]
+        by_store.setdefault(p["store_id"], []).append(p)
+    store_breakdown = {
+        sid: {"items": [p["item"] for p in ps], "subtotal": round(sum((p["price"] for p in ps), 0.0), 2)}
+        for sid, ps in by_store.items()
+    }
 
     return jsonify({
         "requested_items": wanted,
@@ -287,334 +763,501 @@ def compare():
     })
 
 # -------------------- scrape: Food Lion --------------------
-@app.route("/scrape/foodlion", methods=["POST", "GET"])
-def scrape_foodlion():
-    import traceback
-    from playwright.async_api import async_playwright
-    from scrapers.foodlion import AD_URL, OUT_PATH, _extract_deals_from_html
-
-    async def run_and_save_both():
-        chromium_path = _find_chromium_executable()
-        if not chromium_path:
-            return {"ok": False, "error": "Chromium not found on server."}
-
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True, executable_path=chromium_path)
-            ctx = await browser.new_context(
-                user_agent=("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-                            "AppleWebKit/537.36 (KHTML, like Gecko) "
-                            "Chrome/120.0.0.0 Safari/537.36"),
-                locale="en-US",
-            )
-            page = await ctx.new_page()
-            await page.goto(AD_URL, wait_until="networkidle", timeout=45000)
-            await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-            await page.wait_for_timeout(1200)
-            html = await page.content()
-            await ctx.close(); await browser.close()
-
-        DATA_DIR.mkdir(parents=True, exist_ok=True)
-        (DATA_DIR / "debug_foodlion.html").write_text(html, encoding="utf-8")
+# DEBUG_ARTIFACTS=1 turns on ?debug=1 / ?screenshot=1 for every scrape;
+# production leaves it off and only writes the deals JSON.
+_DEBUG_ARTIFACTS = os.environ.get("DEBUG_ARTIFACTS") == "1"
 
-        items = _extract_deals_from_html(html)
-        OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
-        with OUT_PATH.open("w", encoding="utf-8") as f:
-            json.dump(items, f, ensure_ascii=False, indent=2)
+def _artifact_flag(name):
+    return _DEBUG_ARTIFACTS or request.args.get(name) == "1"
 
-        return {"ok": True, "saved_items": len(items),
-                "saved_html": str(DATA_DIR / "debug_foodlion.html"),
-                "saved_json": str(OUT_PATH)}
+def _json_shaped(body):
+    """Cheap capture-time check: body opens with { or [ and closes with } or ]."""
+    return _JSON_START_RE.match(body) is not None and body[-64:].rstrip()[-1:] in (b"}", b"]")
 
+def _valid_json(body):
     try:
-        return asyncio.run(run_and_save_both()), 200
+        jsonio.loads(body)
+        return True
     except Exception:
-        err = traceback.format_exc()
-        (DATA_DIR / "foodlion_error.txt").write_text(err, encoding="utf-8")
-        return {"ok": False, "error": err}, 500
+        return False
 
-# -------------------- scrape: Fresh Market --------------------
-@app.route("/scrape/freshmarket", methods=["POST", "GET"])
-def scrape_freshmarket():
-    import traceback, json, re
-    from playwright.async_api import async_playwright
-    from scrapers.freshmarket import AD_URL, OUT_PATH, _extract_deals_from_html
+# Scrape output writers, run in worker threads: the encoding happens in
+# there too, not on the Playwright loop while building the call's arguments.
+def _save_deals(path, items):
+    jsonio.write_atomic(path, jsonio.dumps(items))
 
-    async def run_and_save_both():
-        chromium_path = _find_chromium_executable()
-        if not chromium_path:
-            return {"ok": False, "error": "Chromium not found on server."}
-
-        html = ""
-        captured_json = []  # network JSON payloads
+def _write_html(path, html):
+    path.write_bytes((html or "").encode("utf-8", "ignore"))
 
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(
-                headless=True,
-                executable_path=chromium_path,
-                args=["--disable-blink-features=AutomationControlled", "--no-sandbox", "--disable-dev-shm-usage"],
-            )
-            ctx = await browser.new_context(
-                user_agent=("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-                            "AppleWebKit/537.36 (KHTML, like Gecko) "
-                            "Chrome/120.0.0.0 Safari/537.36"),
-                locale="en-US",
-                viewport={"width": 1366, "height": 900},
-            )
-            page = await ctx.new_page()
-            page.set_default_timeout(60000)
-
-            # Capture JSON responses while navigating
+def _write_ndjson_responses(path, pairs):
+    """
+    Persist captured (url, body) JSON responses as NDJSON (runs in a worker
+    thread). Capture only checks the outer bytes, so bodies that don't parse
+    are dropped here; the rest are spliced in undecoded, and since CR/LF can
+    only be whitespace in valid JSON, blanking them keeps each response on
+    its own line.
+    """
+    path.write_bytes(b"".join(
+        b'{"url":' + jsonio.dumps(url) + b',"data":'
+        + body.replace(b"\r", b" ").replace(b"\n", b" ") + b"}\n"
+        for url, body in pairs if _valid_json(body)
+    ))
+
+# With debug, the JSON responses the Food Lion ad page fetches are dumped
+# too (foodlion_responses.jsonl), to locate the weekly-ad feed behind the grid.
+_FL_CAPTURE_MAX_COUNT = 200
+_FL_CAPTURE_MAX_BYTES = 50_000_000
+
+async def _scrape_foodlion_async(debug=False):
+    """Scrape the Food Lion ad on the shared browser; writes deals JSON (+ page HTML with debug)."""
+    from scrapers.foodlion import (AD_URL, OUT_PATH, _extract_deals_from_html,
+                                   _settle_after_scroll, _wait_for_price_text)
+
+    chromium_path = _find_chromium_executable()
+    if not chromium_path:
+        return {"ok": False, "error": "Chromium not found on server."}
+
+    async with _scrape_context(
+        chromium_path,
+        user_agent=("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+                    "AppleWebKit/537.36 (KHTML, like Gecko) "
+                    "Chrome/120.0.0.0 Safari/537.36"),
+        locale="en-US",
+    ) as ctx:
+        page = await ctx.new_page()
+        captured = []
+        captured_bytes = 0
+        if debug:
             async def on_response(resp):
+                nonlocal captured_bytes
                 try:
-                    ct = (resp.headers.get("content-type") or "").lower()
-                    url = resp.url
-                    if "application/json" in ct or url.endswith(".json") or "graphql" in url or "/api/" in url:
-                        data = await resp.json()
-                        captured_json.append({"url": url, "data": data})
+                    if len(captured) >= _FL_CAPTURE_MAX_COUNT:
+                        return
+                    if "application/json" in (resp.headers.get("content-type") or "").lower():
+                        body = await resp.body()
+                        # outer-byte check only; the dump writer validates off the loop
+                        if not _json_shaped(body) or captured_bytes + len(body) > _FL_CAPTURE_MAX_BYTES:
+                            return
+                        captured_bytes += len(body)
+                        captured.append((resp.url, body))
                 except Exception:
                     pass
             page.on("response", on_response)
 
-            await page.goto(AD_URL, wait_until="domcontentloaded", timeout=60000)
-
-            # Try common banners
-            for sel in [
-                '#onetrust-accept-btn-handler',
-                'button:has-text("Accept")',
-                '[aria-label="Accept"]',
-                'button:has-text("Allow All")',
-                'button:has-text("I Agree")',
-            ]:
-                try:
-                    await page.locator(sel).first.click(timeout=1500)
-                    break
-                except Exception:
-                    pass
-
-            # Soft scroll to trigger lazy sections
-            try:
-                await page.evaluate("""
-                  const sleep = ms => new Promise(r => setTimeout(r, ms));
-                  (async () => {
-                    for (let y = 0; y <= document.body.scrollHeight; y += 800) {
-                      window.scrollTo(0, y);
-                      await sleep(200);
-                    }
-                    window.scrollTo(0, document.body.scrollHeight);
-                  })();
-                """)
-                await page.wait_for_timeout(1200)
-            except Exception:
-                pass
-
-            # Save artifacts
-            html = await page.content()
-            DATA_DIR.mkdir(parents=True, exist_ok=True)
-            (DATA_DIR / "debug_freshmarket.html").write_text(html or "", encoding="utf-8")
-            await page.screenshot(path=str(DATA_DIR / "debug_freshmarket.png"), full_page=True)
-
-            # Also persist captured JSON for debugging/incremental tuning
-            (DATA_DIR / "freshmarket_responses.json").write_text(
-                json.dumps(captured_json, ensure_ascii=False, indent=2),
-                encoding="utf-8"
-            )
-
-            await ctx.close(); await browser.close()
-
-        # ---------- Extraction pipeline ----------
-        now = datetime.utcnow()
-
-        def _parse_money_any(val):
-            """
-            Accept numbers, '$5.99', '99¢', '2 for $5', '2/$5', etc.
-            Returns float or None.
-            """
-            if val is None:
-                return None
-            if isinstance(val, (int, float)):
-                try:
-                    return float(val)
-                except Exception:
-                    return None
+        # networkidle rarely settles on the ad-heavy page; wait for price text instead
+        await page.goto(AD_URL, wait_until="domcontentloaded", timeout=30000)
+        await _wait_for_price_text(page)
+        await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
+        await _settle_after_scroll(page, timeout=1200)
+        html = await page.content()
+
+    # parsing and the writes run off the loop so the other scrape keeps
+    # moving; debug artifacts are written while the page is parsed
+    jobs = [asyncio.to_thread(_extract_deals_from_html, html)]
+    if debug:
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        jobs.append(asyncio.to_thread(_write_html, DATA_DIR / "debug_foodlion.html", html))
+        jobs.append(asyncio.to_thread(
+            _write_ndjson_responses, DATA_DIR / "foodlion_responses.jsonl", list(captured)))
+    items = (await asyncio.gather(*jobs))[0]
+    OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    await asyncio.to_thread(_save_deals, OUT_PATH, items)
+    _invalidate_deals_caches()
+
+    return {"ok": True, "saved_items": len(items),
+            "saved_html": str(DATA_DIR / "debug_foodlion.html") if debug else None,
+            "saved_json": str(OUT_PATH),
+            "saved_captured_json": str(DATA_DIR / "foodlion_responses.jsonl") if debug else None}
 
-            s = str(val).replace("\u00a0", " ").strip()
+@app.route("/scrape/foodlion", methods=["POST", "GET"])
+def scrape_foodlion():
+    """
+    ?debug=1 also saves the rendered page as debug_foodlion.html and the
+    page's JSON responses as foodlion_responses.jsonl.
+    """
+    import traceback
 
-            # 2 for $5 / 2/$5
-            m = re.search(r"(\d+)\s*(?:for|/)\s*\$?\s*([0-9]+(?:\.[0-9]{1,2})?)", s, re.I)
-            if m:
-                qty = int(m.group(1))
-                total = float(m.group(2))
-                if qty > 0:
-                    return round(total / qty, 2)
+    debug = _artifact_flag("debug")
+    try:
+        return _run_on_pw_loop(_scrape_foodlion_async(debug=debug)), 200
+    except Exception:
+        err = traceback.format_exc()
+        (DATA_DIR / "foodlion_error.txt").write_text(err, encoding="utf-8")
+        return {"ok": False, "error": err}, 500
 
-            # $5.99 / 5.99
-            m = re.search(r"\$?\s*([0-9]+(?:\.[0-9]{1,2})?)", s)
-            if m:
-                try:
-                    return float(m.group(1))
-                except Exception:
-                    pass
+# -------------------- scrape: Fresh Market --------------------
+def _fm_extract_items(captured_urls, captured_bodies, html, html_fallback=True):
+    """
+    Fresh Market deal rows from captured network JSON (url/body lists) and
+    the page HTML: mined JSON first, the heuristic HTML parser last (skipped
+    with html_fallback=False).
+    """
+    from scrapers.freshmarket import AD_URL, _extract_deals_from_html
+
+    # ---------- Extraction pipeline ----------
+    now = datetime.utcnow()
+
+    # (item.lower(), price) pairs already added; duplicates are dropped
+    # on insert so no second dedup pass is needed.
+    seen = set()
+
+    def _add_item(items_list, name, price, size_text=""):
+        """True once (name, price) is usable, whether newly added or already seen."""
+        price_val = _parse_money_any(price)
+        if price_val is None:
+            return False
+        if not name or len(str(name).strip()) < 3:
+            return False
+        item = str(name).strip()[:120]
+        key = (item.lower(), float(price_val))
+        if key in seen:
+            return True
+        seen.add(key)
+        # only the per-item fields; the shared ones are filled in at save time
+        items_list.append((item, (size_text or "").strip(), float(price_val)))
+        return True
+
+    # Walk arbitrary JSON and try common shapes -> (item, size_text, price) rows
+    items_from_json: list[tuple] = []
+
+    # id()s of containers already walked. Steps A and B overlap (B re-walks the
+    # features payloads), and features_roots keeps those objects alive, so ids
+    # stay unique for them; trees decoded only for B get a fresh set.
+    walked = set()
+
+    def walk(root, seen=walked):
+        # Iterative pre-order DFS: same visit order as a recursive walk,
+        # without a Python frame per node or recursion-limit issues.
+        # Only containers are pushed; depth is capped and shared subtrees
+        # are visited once, so hostile payloads can't blow up the walk.
+        _dict, _list, _containers = dict, list, (dict, list)
+        stack = [(root, 0)]
+        while stack:
+            obj, depth = stack.pop()
+            if depth > _FM_WALK_MAX_DEPTH:
+                continue
+            oid = id(obj)
+            if oid in seen:
+                continue
+            seen.add(oid)
+            child_depth = depth + 1
+            if not isinstance(obj, _dict):
+                if isinstance(obj, _list):
+                    stack.extend([(v, child_depth) for v in reversed(obj) if isinstance(v, _containers)])
+                continue
 
-            # 99¢
-            m = re.search(r"([0-9]+)\s*¢", s)
-            if m:
-                try:
-                    return float(m.group(1)) / 100.0
-                except Exception:
-                    return None
-            return None
+            # Most nodes carry no name-ish key at all; skip them with one C-level check.
+            if obj.keys().isdisjoint(_FM_NAME_KEYS):
+                stack.extend([(v, child_depth) for v in reversed(obj.values()) if isinstance(v, _containers)])
+                continue
 
-        def _add_item(items_list, name, price, size_text=""):
-            price_val = _parse_money_any(price)
-            if price_val is None:
-                return
-            if not name or len(str(name).strip()) < 3:
-                return
-            items_list.append({
-                "store_id": "fresh-market-24503",
-                "item": str(name).strip()[:120],
-                "size_text": (size_text or "").strip(),
-                "price": float(price_val),
-                "unit_qty": None,
-                "unit": None,
-                "start_date": now.date().isoformat(),
-                "end_date": (now + timedelta(days=7)).date().isoformat(),
-                "promo_text": "Weekly Features",
-                "source": AD_URL,
-                "fetched_at": now.isoformat() + "Z",
-            })
-
-        # Walk arbitrary JSON and try common shapes
-        items_from_json: list[dict] = []
-
-        def walk(obj):
-            if isinstance(obj, dict):
-                # --- candidate name fields (keep generous) ---
-                name = (
-                    obj.get("name") or obj.get("title") or obj.get("headline")
-                    or obj.get("productName") or obj.get("description")
-                    or obj.get("primaryText") or obj.get("tileHeadline")
-                    or obj.get("eyebrow")
-                )
-
-                # --- candidate numeric/explicit price fields ---
-                cand_prices = [
-                    obj.get("price"), obj.get("salePrice"), obj.get("sale_price"),
-                    obj.get("priceValue"), obj.get("priceText"), obj.get("formattedPrice"),
-                    obj.get("amount"), obj.get("value"), obj.get("regularPrice"),
-                    obj.get("finalPrice"), obj.get("wasPrice"), obj.get("nowPrice"),
-                    obj.get("currentPrice"), obj.get("pricePerPound"), obj.get("price_per"),
-                    obj.get("tilePrice"), obj.get("priceString"),
-                ]
-
-                # nested price object(s)
-                p = obj.get("price")
-                if isinstance(p, dict):
-                    cand_prices += [p.get("amount"), p.get("value"), p.get("current"), p.get("sale")]
-
-                # --- parse price from text-y fields, common in marketing tiles ---
-                text_fields = [
-                    obj.get("copy"), obj.get("body"), obj.get("text"),
-                    obj.get("subtitle"), obj.get("blurb"), obj.get("richText"),
-                    obj.get("html"), obj.get("content"), obj.get("secondaryText"),
-                    obj.get("tileSubheadline"), obj.get("tileCopy"),
-                ]
-                for tf in text_fields:
-                    parsed = _parse_money_any(tf)
-                    if parsed is not None:
-                        cand_prices.append(parsed)
+            get = obj.get
+            name = None
+            for k in _FM_NAME_KEYS:
+                name = get(k)
+                if name:
+                    break
 
+            if name:
                 # --- unit/size hints ---
-                size_text = (
-                    obj.get("unit") or obj.get("uom") or obj.get("size") or obj.get("sizeText")
-                    or obj.get("unitOfMeasure") or obj.get("unitText") or obj.get("priceUnit")
-                )
-
-                if name and any(cp is not None for cp in cand_prices):
-                    for cp in cand_prices:
-                        if cp is None:
-                            continue
-                        _add_item(items_from_json, name, cp, size_text)
-
-                # recurse
-                for v in obj.values():
-                    walk(v)
-
-            elif isinstance(obj, list):
-                for v in obj:
-                    walk(v)
-
-        # A) Special-case: mine Next.js features payload
-        features_blobs = [
-            b for b in captured_json
-            if "/_next/data/" in (b.get("url") or "") and "features/weekly-features" in b.get("url", "")
-            and isinstance(b.get("data"), dict)
-        ]
-        for fb in features_blobs:
-            data = fb["data"]
-            page_props = data.get("pageProps", data)
-            walk(page_props)
-
-        # B) If still sparse, walk all captured JSON
-        if len(items_from_json) < 3:
-            for blob in captured_json:
-                walk(blob["data"])
-
-        # C) If still empty, mine embedded JSON from HTML (ld+json / __NEXT_DATA__/__NUXT__)
-        if not items_from_json:
+                size_text = None
+                for k in _FM_SIZE_KEYS:
+                    size_text = get(k)
+                    if size_text:
+                        break
+
+                # one item per node: the first candidate that parses wins, so
+                # price/salePrice/priceText echoes of one tile don't add rows
+                # (and text fields are only parsed when no price key did)
+                for cp in _fm_price_candidates(get):
+                    if cp is not None and _add_item(items_from_json, name, cp, size_text):
+                        break
+
+            # children go on the stack reversed so they pop in document order
+            stack.extend([(v, child_depth) for v in reversed(obj.values()) if isinstance(v, _containers)])
+
+    # A) Special-case: mine Next.js features payload (urls are checked
+    # before any body is decoded)
+    features_roots = {}
+    for i, url in enumerate(captured_urls):
+        if "/_next/data/" in url and "features/weekly-features" in url:
             try:
-                embedded = []
-                for m in re.finditer(r'<script[^>]+type=["\']application/ld\+json["\'][^>]*>(.*?)</script>', html, re.S|re.I):
-                    try:
-                        embedded.append(json.loads(m.group(1)))
-                    except Exception:
-                        pass
-                for m in re.finditer(r'>(?:window\.__NEXT_DATA__|window\.__NUXT__)\s*=\s*(\{.*?\});?\s*<', html, re.S):
+                data = jsonio.loads(captured_bodies[i])
+            except Exception:  # capture only checked the outer bytes
+                continue
+            if isinstance(data, dict):
+                features_roots[i] = data
+                walk(data.get("pageProps", data))
+
+    # B) If still sparse, walk all captured JSON, one decoded tree at a time
+    if len(items_from_json) < 3:
+        for i, body in enumerate(captured_bodies):
+            data = features_roots.get(i)
+            if data is not None:
+                walk(data)
+                continue
+            try:
+                data = jsonio.loads(body)
+            except Exception:
+                continue
+            walk(data, set())
+
+    # C) If still empty, mine embedded JSON from HTML (ld+json / __NEXT_DATA__/__NUXT__)
+    if not items_from_json:
+        # Walk each blob as soon as it parses so only one decoded tree
+        # is alive at a time (Next.js state can run to several MB).
+        try:
+            for rx in (_LD_JSON_RE, _NEXT_DATA_SCRIPT_RE, _NEXT_DATA_RE):
+                for m in rx.finditer(html):
                     try:
-                        embedded.append(json.loads(m.group(1)))
+                        root = jsonio.loads(m.group(1))
                     except Exception:
-                        pass
-                for root in embedded:
-                    walk(root)
+                        continue
+                    if rx is _NEXT_DATA_SCRIPT_RE and isinstance(root, dict):
+                        # products live in the page props, as in the /_next/data/ payload
+                        props = root.get("props")
+                        if isinstance(props, dict) and isinstance(props.get("pageProps"), dict):
+                            root = props["pageProps"]
+                    # roots are freed one by one here, so ids may be reused: fresh seen set
+                    walk(root, set())
+                    del root
+        except Exception:
+            pass
+
+    if items_from_json:
+        # every row shares these values; build them once
+        store_id, promo_text = "fresh-market-24503", "Weekly Features"
+        start_date = now.date().isoformat()
+        end_date = (now + timedelta(days=7)).date().isoformat()
+        fetched_at = now.isoformat() + "Z"
+        items = [{
+            "store_id": store_id,
+            "item": name,
+            "size_text": size_text,
+            "price": price,
+            "unit_qty": None,
+            "unit": None,
+            "start_date": start_date,
+            "end_date": end_date,
+            "promo_text": promo_text,
+            "source": AD_URL,
+            "fetched_at": fetched_at,
+        } for name, size_text, price in items_from_json]
+    elif html_fallback:
+        # D) Final fallback: heuristic HTML parser (dedupes on the same key)
+        items = _extract_deals_from_html(html or "")
+    else:
+        items = []
+    return items
+
+def _fetch_static_html(url):
+    """Page HTML over plain HTTP (per-thread keep-alive session), or None on any failure."""
+    try:
+        session = getattr(_HTTP_LOCAL, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers["User-Agent"] = (
+                "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+                "AppleWebKit/537.36 (KHTML, like Gecko) "
+                "Chrome/120.0.0.0 Safari/537.36")
+            _HTTP_LOCAL.session = session
+        r = session.get(url, timeout=_FM_HTTP_TIMEOUT)
+        r.raise_for_status()
+        return r.text
+    except Exception:
+        return None
+
+async def _scrape_freshmarket_async(screenshot=False, debug=False):
+    """
+    Scrape Fresh Market weekly features: JSON embedded in the plain-HTTP page
+    first, then the shared browser (network JSON first, HTML fallback). The
+    page HTML and full-page PNG are only written when asked for, and always
+    come from the browser.
+    """
+    from scrapers.freshmarket import AD_URL, OUT_PATH
+
+    if not (debug or screenshot):
+        html = await asyncio.to_thread(_fetch_static_html, AD_URL)
+        # only trust mined JSON here; the heuristic parser waits for the rendered page
+        items = await asyncio.to_thread(_fm_extract_items, [], [], html, False) if html else []
+        if items:
+            OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
+            await asyncio.to_thread(_save_deals, OUT_PATH, items)
+            _invalidate_deals_caches()
+            return {"ok": True, "saved_items": len(items), "source": "http",
+                    "captured_json_count": 0, "saved_html": None, "saved_png": None,
+                    "saved_json": str(OUT_PATH), "saved_captured_json": None}
+
+    chromium_path = _find_chromium_executable()
+    if not chromium_path:
+        return {"ok": False, "error": "Chromium not found on server."}
+
+    html = ""
+    # network JSON payloads, kept as raw bodies (parallel to their urls) and
+    # decoded only when mined: bytes are a fraction of the parsed trees
+    captured_urls: list[str] = []
+    captured_bodies: list[bytes] = []
+    captured_bytes = 0
+
+    async with _scrape_context(
+        chromium_path,
+        blocked_types=_SCREENSHOT_BLOCKED_RESOURCE_TYPES if screenshot else _BLOCKED_RESOURCE_TYPES,
+        user_agent=("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+                    "AppleWebKit/537.36 (KHTML, like Gecko) "
+                    "Chrome/120.0.0.0 Safari/537.36"),
+        locale="en-US",
+        viewport={"width": 1366, "height": 900},
+    ) as ctx:
+        await ctx.add_init_script(_SOFT_SCROLL_JS)
+        page = await ctx.new_page()
+        page.set_default_timeout(60000)
+
+        # Capture JSON responses while navigating
+        async def on_response(resp):
+            nonlocal captured_bytes
+            try:
+                url = resp.url
+                if len(captured_urls) >= _FM_CAPTURE_MAX_COUNT or not _FM_PRODUCT_URL_RE.search(url):
+                    return
+                ct = (resp.headers.get("content-type") or "").lower()
+                if "application/json" in ct or url.endswith(".json") or "graphql" in url or "/api/" in url:
+                    body = await resp.body()
+                    # only kept bodies are charged to the count/byte caps
+                    if not _json_shaped(body):
+                        return
+                    if captured_bytes + len(body) > _FM_CAPTURE_MAX_BYTES:
+                        return
+                    captured_bytes += len(body)
+                    captured_urls.append(url)
+                    captured_bodies.append(body)
             except Exception:
                 pass
+        page.on("response", on_response)
+
+        await page.goto(AD_URL, wait_until="domcontentloaded", timeout=60000)
+
+        # Try common banners: one union locator, so a page without a banner
+        # costs a single 1.5 s wait instead of one per selector.
+        banner_selectors = [
+            '#onetrust-accept-btn-handler',
+            'button:has-text("Accept")',
+            '[aria-label="Accept"]',
+            'button:has-text("Allow All")',
+            'button:has-text("I Agree")',
+        ]
+        banner = page.locator(banner_selectors[0])
+        for sel in banner_selectors[1:]:
+            banner = banner.or_(page.locator(sel))
+        try:
+            await banner.first.click(timeout=1500)
+        except Exception:
+            pass
 
-        # D) Final fallback: heuristic HTML parser
-        items = items_from_json if items_from_json else _extract_deals_from_html(html or "")
+        # Soft scroll to trigger lazy sections (fire and forget, like before),
+        # then wait until the pass is done, capped at the old fixed 1.2 s
+        try:
+            await page.evaluate("() => { window.__softScroll(); }")
+            await page.wait_for_function(
+                "() => window.__softScrollDone === true", polling=100, timeout=_SOFT_SCROLL_WAIT_MS)
+        except Exception:
+            pass
 
-        # Deduplicate (name|price)
-        seen = set()
-        deduped = []
-        for it in items:
-            key = (it["item"].lower(), float(it["price"]))
-            if key in seen:
-                continue
-            seen.add(key)
-            deduped.append(it)
-        items = deduped
-
-        # Save JSON
-        OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
-        with OUT_PATH.open("w", encoding="utf-8") as f:
-            json.dump(items, f, ensure_ascii=False, indent=2)
-
-        return {
-            "ok": True,
-            "saved_items": len(items),
-            "captured_json_count": len(captured_json),
-            "saved_html": str(DATA_DIR / "debug_freshmarket.html"),
-            "saved_png": str(DATA_DIR / "debug_freshmarket.png"),
-            "saved_json": str(OUT_PATH),
-            "saved_captured_json": str(DATA_DIR / "freshmarket_responses.json"),
-        }
+        # Save artifacts (debug only). The screenshot runs in Chromium and the
+        # file writes in worker threads, so they overlap instead of queueing.
+        html = await page.content()
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        # late responses may still append
+        captured_snapshot = list(zip(captured_urls, captured_bodies)) if debug else []
+
+        # file writes start now and are only awaited after parsing below
+        writes = []
+        if debug:
+            # also persist captured JSON for debugging/incremental tuning
+            writes.append(asyncio.ensure_future(asyncio.to_thread(
+                _write_ndjson_responses, DATA_DIR / "freshmarket_responses.jsonl", captured_snapshot)))
+            writes.append(asyncio.ensure_future(asyncio.to_thread(
+                _write_html, DATA_DIR / "debug_freshmarket.html", html)))
+        if screenshot:
+            try:
+                await page.screenshot(path=str(DATA_DIR / "debug_freshmarket.png"), full_page=True)
+            except BaseException:
+                await asyncio.gather(*writes, return_exceptions=True)  # don't leave them orphaned
+                raise
+
+    # parsing runs off the loop so the other scrape keeps moving; the debug
+    # writes finish alongside it
+    items = (await asyncio.gather(
+        asyncio.to_thread(_fm_extract_items, captured_urls, captured_bodies, html), *writes))[0]
+
+    # Save JSON
+    OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    await asyncio.to_thread(_save_deals, OUT_PATH, items)
+    _invalidate_deals_caches()
+
+    return {
+        "ok": True,
+        "saved_items": len(items),
+        "source": "browser",
+        "captured_json_count": len(captured_urls),
+        "saved_html": str(DATA_DIR / "debug_freshmarket.html") if debug else None,
+        "saved_png": str(DATA_DIR / "debug_freshmarket.png") if screenshot else None,
+        "saved_json": str(OUT_PATH),
+        "saved_captured_json": str(DATA_DIR / "freshmarket_responses.jsonl") if debug else None,
+    }
+
+@app.route("/scrape/freshmarket", methods=["POST", "GET"])
+def scrape_freshmarket():
+    """
+    ?debug=1 also saves the rendered page as debug_freshmarket.html and the
+    captured JSON responses as freshmarket_responses.jsonl;
+    ?screenshot=1 also saves debug_freshmarket.png (slow on long pages).
+    """
+    import traceback
 
+    screenshot = _artifact_flag("screenshot")
+    debug = _artifact_flag("debug")
     try:
-        return asyncio.run(run_and_save_both()), 200
+        return _run_on_pw_loop(_scrape_freshmarket_async(screenshot=screenshot, debug=debug)), 200
     except Exception:
         err = traceback.format_exc()
         (DATA_DIR / "freshmarket_error.txt").write_text(err, encoding="utf-8")
         return {"ok": False, "error": err}, 500
 
+# -------------------- scrape: all stores --------------------
+@app.route("/scrape/all", methods=["POST", "GET"])
+def scrape_all():
+    """
+    Run every scraper concurrently on the shared browser (wall time ~ slowest store).
+    Accepts the same ?debug=1 / ?screenshot=1 flags as the single-store routes.
+    """
+    import traceback
+
+    screenshot = _artifact_flag("screenshot")
+    debug = _artifact_flag("debug")
+    names = ("foodlion", "freshmarket")
+
+    async def run_all():
+        return await asyncio.gather(
+            _scrape_foodlion_async(debug=debug),
+            _scrape_freshmarket_async(screenshot=screenshot, debug=debug),
+            return_exceptions=True,
+        )
+
+    try:
+        outcomes = _run_on_pw_loop(run_all())
+    except Exception:
+        return {"ok": False, "error": traceback.format_exc()}, 500
+
+    results, failed = {}, False
+    for name, res in zip(names, outcomes):
+        if isinstance(res, BaseException):
+            err = "".join(traceback.format_exception(type(res), res, res.__traceback__))
+            (DATA_DIR / f"{name}_error.txt").write_text(err, encoding="utf-8")
+            res, failed = {"ok": False, "error": err}, True
+        results[name] = res
+    ok = all(r.get("ok") for r in results.values())
+    return {"ok": ok, "results": results}, (500 if failed else 200)
+
 # -------------------- simple UI (/app) --------------------
 @app.get("/app")
 def app_ui():
@@ -702,6 +1345,7 @@ def app_ui():
           <ul class="small">
             <li><span class="mono">POST /scrape/foodlion</span></li>
             <li><span class="mono">POST /scrape/freshmarket</span></li>
+            <li><span class="mono">POST /scrape/all</span></li>
           </ul>
         </div>
 
@@ -884,4 +1528,5 @@ checkHealth();
 
 # -------------------- main --------------------
 if __name__ == "__main__":
-    app.run(debug=True)
+    # dev server only (production runs under gunicorn); FLASK_DEBUG=1 for the debugger/reloader
+    app.run(debug=os.environ.get("FLASK_DEBUG") == "1")
@@ -0,0 +1,14 @@
+# gunicorn.conf.py: picked up automatically by `gunicorn app:app`.
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# Threaded workers, not gevent: scrapes run on a real asyncio loop thread
+# (see _pw_loop in app.py), which gevent's monkey-patching would break.
+# Threads keep /deals, /compare and /health answering while a scrape runs.
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+
+# A full /scrape/all can take well over gunicorn's 30 s default.
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "180"))
@@ -1,61 +1,118 @@
 # scrapers/foodlion.py
+import os
 import re
-import json
 from pathlib import Path
 from datetime import datetime, timedelta
-from bs4 import BeautifulSoup
 from playwright.async_api import async_playwright, TimeoutError as PWTimeout
 from flask import Response
-# at top with other imports
-import os, glob
+from utils import jsonio
+from utils.blocking import resource_blocker
+from utils.chromium import find_chromium_executable as _find_chromium
+from utils.htmlscan import parse_html, scan_cards, stripped_text
 
 AD_URL = "https://www.foodlion.com/savings/weekly-ad/grid-view"
 OUT_PATH = Path(__file__).resolve().parents[1] / "data" / "deals_foodlion.json"
 ZIP = "24503"
-# add this helper near the top
-def _find_chromium():
-    for base in ("/opt/render/project/src/.playwright", "/opt/render/.cache/ms-playwright"):
-        matches = sorted(glob.glob(os.path.join(base, "chromium-*", "chrome-linux", "chrome")))
-        if matches:
-            return matches[-1]
-    return None
+# Cookies/storage saved after the first ZIP/store setup that the page
+# confirmed; delete it to pick the store again.
+STATE_PATH = OUT_PATH.parent / "foodlion_state.json"
+
+# The ad grid is rendered client-side; the page is usable once any
+# "$<digit>" text shows up (polled, not per animation frame).
+_PRICE_TEXT_JS = "() => /\\$\\s*\\d/.test(document.body ? document.body.innerText : '')"
+
+async def _wait_for_price_text(page, timeout=15000):
+    """Wait for rendered prices instead of networkidle; gives up quietly."""
+    try:
+        await page.wait_for_function(_PRICE_TEXT_JS, polling=250, timeout=timeout)
+    except Exception:
+        pass
+
+# True once document height has held still for three 250 ms polls in a
+# row; lazy tiles appended by a scroll grow the page and restart the count.
+_HEIGHT_STABLE_JS = """() => {
+  const h = document.body ? document.body.scrollHeight : 0;
+  if (window.__settleHeight === h) {
+    window.__settleStable = (window.__settleStable || 0) + 1;
+  } else {
+    window.__settleHeight = h;
+    window.__settleStable = 0;
+  }
+  return window.__settleStable >= 3;
+}"""
+
+async def _settle_after_scroll(page, timeout=1500):
+    """Let lazy tiles load after a scroll: waits for the page height to stop growing, at most timeout ms."""
+    try:
+        await page.evaluate("() => { window.__settleHeight = -1; window.__settleStable = 0; }")
+        await page.wait_for_function(_HEIGHT_STABLE_JS, polling=250, timeout=timeout)
+    except Exception:
+        pass
+
+_PRICE_RE = re.compile(r"\$?\s*([0-9]+(?:\.[0-9]{1,2})?)")
+# Prices are read right after a "$": str.find locates it and the regex only
+# ever sees this many characters from there.
+_PRICE_WINDOW = 24
+# Size hints in priority order; one alternation finds them all in a single
+# pass and the best-ranked hit wins (same result as trying them in order).
+_SIZE_HINTS = ("per lb", "lb", "oz", "dozen", "each", "ea", "ct", "pk", "pack")
+_SIZE_HINT_RANK = {h: i for i, h in enumerate(_SIZE_HINTS)}
+_SIZE_HINT_RE = re.compile(r"\b(" + "|".join(re.escape(h) for h in _SIZE_HINTS) + r")\b", re.I)
 
 def _parse_price(text: str):
     if not text:
         return None
-    m = re.search(r"\$?\s*([0-9]+(?:\.[0-9]{1,2})?)", text.replace(",", ""))
-    return float(m.group(1)) if m else None
+    idx = text.find("$")
+    while idx >= 0:
+        m = _PRICE_RE.match(text[idx:idx + _PRICE_WINDOW].replace(",", ""))
+        if m:
+            return float(m.group(1))
+        idx = text.find("$", idx + 1)
+    return None
+
+def _size_hint(text: str):
+    """First of _SIZE_HINTS (in list order) that appears as a word in text, or None."""
+    ranks = [_SIZE_HINT_RANK[m.group(1).lower()] for m in _SIZE_HINT_RE.finditer(text)]
+    return _SIZE_HINTS[min(ranks)] if ranks else None
+
+_CARD_TAGS = frozenset({"article", "div", "li"})
 
 def _extract_deals_from_html(html: str) -> list:
-    soup = BeautifulSoup(html, "lxml")
     deals = []
-    # Heuristic: scan containers; tighten once you inspect the DOM
-    cards = soup.find_all(["article", "div", "li"], recursive=True)
-    for card in cards:
-        text = " ".join(card.get_text(" ", strip=True).split())
-        if "$" not in text:
-            continue
+    seen = set()
+    # one timestamp per page; every deal from it shares the same dates
+    now = datetime.utcnow()
+    start_date = now.date().isoformat()
+    end_date = (now + timedelta(days=7)).date().isoformat()
+    fetched_at = now.isoformat() + "Z"
+
+    # Heuristic: scan containers; tighten once you inspect the DOM.
+    # Each price goes to the smallest card that yields an item, so page
+    # wrappers no longer add bogus (first heading, first price) rows.
+    def card(el, text, priced):
         price = _parse_price(text)
         if not price:
-            continue
+            return False
 
         name_candidate = None
-        for tag in card.find_all(["h2", "h3", "h4", "p", "div"], recursive=True):
-            t = tag.get_text(" ", strip=True)
-            if t and "$" not in t and len(t) > 2:
+        for tag in el.iterdescendants("h2", "h3", "h4", "p", "div"):
+            if tag in priced:
+                continue  # its text holds a "$"
+            t = stripped_text(tag)
+            if len(t) > 2:
                 name_candidate = t
                 break
         if not name_candidate:
-            name_candidate = text.split("$", 1)[0].strip()
+            name_candidate = text[:text.find("$")].rstrip()
             if len(name_candidate) < 3:
-                continue
+                return False
 
-        size_text = None
-        for unit_hint in ["per lb", "lb", "oz", "dozen", "each", "ea", "ct", "pk", "pack"]:
-            if re.search(rf"\b{unit_hint}\b", text, re.I):
-                size_text = unit_hint
-                break
+        key = (name_candidate[:120].lower(), price)
+        if key in seen:
+            return True
+        seen.add(key)
 
+        size_text = _size_hint(text)
         deals.append({
             "store_id": "food-lion-24503",
             "item": name_candidate[:120],
@@ -63,165 +120,203 @@ def _extract_deals_from_html(html: str) -> list:
             "price": price,
             "unit_qty": None,
             "unit": None,
-            "start_date": datetime.utcnow().date().isoformat(),
-            "end_date": (datetime.utcnow() + timedelta(days=7)).date().isoformat(),
+            "start_date": start_date,
+            "end_date": end_date,
             "promo_text": "Weekly Ad",
             "source": AD_URL,
-            "fetched_at": datetime.utcnow().isoformat() + "Z",
+            "fetched_at": fetched_at,
         })
+        return True
+
+    scan_cards(parse_html(html), lambda el: el.tag in _CARD_TAGS, card)
+    return deals
+
+# Weekly-ad data requests the grid reloads from after a store change.
+_AD_DATA_URL_RE = re.compile(r"weekly-?ad|circular|flyer|promotion|savings", re.I)
+# Time given to the grid to re-render once that data has arrived.
+_GRID_RENDER_MS = 500
+
+def _is_ad_data_response(resp):
+    return (resp.request.resource_type in ("xhr", "fetch")
+            and _AD_DATA_URL_RE.search(resp.url) is not None)
+
+def _any_of(page, selectors):
+    """One locator matching any of selectors (first match in page order)."""
+    loc = page.locator(selectors[0])
+    for sel in selectors[1:]:
+        loc = loc.or_(page.locator(sel))
+    return loc.first
+
+# The header's store label once a store near ZIP is active.
+_STORE_LABEL_SELECTORS = [
+    f'[data-testid*="store"]:has-text("{ZIP}")',
+    f'header :is(a, button, span):has-text("{ZIP}")',
+]
 
-    # de-dup
-    seen, unique = set(), []
-    for d in deals:
-        key = (d["item"].lower(), d["price"])
-        if key not in seen:
-            seen.add(key)
-            unique.append(d)
-    return unique
+async def _store_confirmed(page, timeout=5000) -> bool:
+    """True if the store label shows ZIP within timeout ms."""
+    try:
+        await _any_of(page, _STORE_LABEL_SELECTORS).wait_for(state="visible", timeout=timeout)
+        return True
+    except PWTimeout:
+        return False
+
+async def _set_zip_and_select_store(page) -> bool:
+    """
+    Walk the cookie/ZIP/store flow; every step is optional. True only when
+    the store label confirms a store for ZIP afterwards.
+    """
+    # Each step probes its candidate selectors as one union locator, so a
+    # missing control costs a single timeout instead of one per selector.
 
-async def _set_zip_and_select_store(page):
     # Cookie banner (try common buttons)
-    for selector in [
-        'button:has-text("Accept All")',
-        'button:has-text("Accept")',
-        'button[aria-label="Accept all"]',
-        'button:has-text("I Accept")',
-    ]:
-        try:
-            await page.locator(selector).click(timeout=1500)
-            break
-        except PWTimeout:
-            pass
+    try:
+        await _any_of(page, [
+            'button:has-text("Accept All")',
+            'button:has-text("Accept")',
+            'button[aria-label="Accept all"]',
+            'button:has-text("I Accept")',
+        ]).click(timeout=2500)
+    except PWTimeout:
+        pass
 
     # Try to open "Change/Set Store" flow
     # We attempt several likely buttons/links—site markup can change.
-    store_openers = [
-        'button:has-text("Change Store")',
-        'button:has-text("Set My Store")',
-        'a:has-text("Change Store")',
-        'a:has-text("Set My Store")',
-        '[data-testid="change-store"]',
-    ]
-    opened = False
-    for sel in store_openers:
-        try:
-            await page.locator(sel).first.click(timeout=2500)
-            opened = True
-            break
-        except PWTimeout:
-            continue
+    try:
+        await _any_of(page, [
+            'button:has-text("Change Store")',
+            'button:has-text("Set My Store")',
+            'a:has-text("Change Store")',
+            'a:has-text("Set My Store")',
+            '[data-testid="change-store"]',
+        ]).click(timeout=2500)
+    except PWTimeout:
+        pass
 
     # If no explicit opener, sometimes a store picker is inline—try focusing the input directly.
-    search_inputs = [
-        'input[placeholder*="ZIP"]',
-        'input[aria-label*="ZIP"]',
-        'input[placeholder*="zip"]',
-        'input[aria-label*="zip"]',
-        'input[type="search"]',
-    ]
-    for sel in search_inputs:
-        try:
-            inp = page.locator(sel).first
-            await inp.fill(ZIP, timeout=2500)
-            await inp.press("Enter")
-            break
-        except PWTimeout:
-            continue
-
-    # Pick the first store result if a list appears
-    possible_store_cards = [
-        '[data-testid="store-card"] button:has-text("Select")',
-        'button:has-text("Make This My Store")',
-        'button:has-text("Select Store")',
-    ]
-    for sel in possible_store_cards:
-        try:
-            await page.locator(sel).first.click(timeout=4000)
-            break
-        except PWTimeout:
-            continue
+    try:
+        inp = _any_of(page, [
+            'input[placeholder*="ZIP"]',
+            'input[aria-label*="ZIP"]',
+            'input[placeholder*="zip"]',
+            'input[aria-label*="zip"]',
+            'input[type="search"]',
+        ])
+        await inp.fill(ZIP, timeout=2500)
+        await inp.press("Enter")
+    except PWTimeout:
+        pass
 
-    # Give the ad grid time to reload for the chosen store
-    await page.wait_for_load_state("networkidle", timeout=15000)
-    await page.wait_for_timeout(1500)
+    # Pick the first store result if a list appears. The default store's
+    # prices are already on the page, so price text can't tell the grids
+    # apart; wait for the ad data the new store triggers instead.
+    selected = False
+    try:
+        async with page.expect_response(_is_ad_data_response, timeout=15000):
+            await _any_of(page, [
+                '[data-testid="store-card"] button:has-text("Select")',
+                'button:has-text("Make This My Store")',
+                'button:has-text("Select Store")',
+            ]).click(timeout=4000)
+            selected = True
+        # the grid re-renders from that response
+        await page.wait_for_timeout(_GRID_RENDER_MS)
+    except PWTimeout:
+        if selected:
+            # no recognisable ad request seen; fall back to the old fixed wait
+            await page.wait_for_timeout(1500)
+    return await _store_confirmed(page)
 
-async def fetch_foodlion_deals_async() -> list:
-    async with async_playwright() as p:
-        chromium_path = _find_chromium()
-        browser = await p.chromium.launch(
-            headless=True,
-            executable_path=chromium_path  # <— add this
-        )
-        context = await browser.new_context(
-            user_agent=("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-                        "AppleWebKit/537.36 (KHTML, like Gecko) "
-                        "Chrome/120.0.0.0 Safari/537.36"),
-            locale="en-US",
-        )
-        ...
+async def _render_ad(browser) -> tuple:
+    """Render the weekly ad in a fresh context on browser; returns (deals, HTML)."""
+    # A saved session already carries the chosen store, so the ZIP dance is
+    # skipped (as long as the page agrees; see below).
+    have_state = STATE_PATH.is_file()
+    context = await browser.new_context(
+        user_agent=("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+                    "AppleWebKit/537.36 (KHTML, like Gecko) "
+                    "Chrome/120.0.0.0 Safari/537.36"),
+        locale="en-US",
+        # service-worker fetches bypass context.route, so keep them off
+        service_workers="block",
+        storage_state=str(STATE_PATH) if have_state else None,
+    )
+    try:
+        # the parser only reads the DOM text; same blocking as the app's scrapes
+        await context.route("**/*", resource_blocker())
         page = await context.new_page()
-        await page.goto(AD_URL, wait_until="networkidle", timeout=45000)
+        await page.goto(AD_URL, wait_until="domcontentloaded", timeout=30000)
+        await _wait_for_price_text(page)
 
-        # Try to ensure ZIP is set so deals load
-        try:
-            await _set_zip_and_select_store(page)
-        except Exception as e:
-            print(f"[foodlion] ZIP/store setup warning: {e}")
+        # A saved session that doesn't show our store is stale (or came from
+        # a bad run); drop it and pick the store again.
+        if have_state and not await _store_confirmed(page):
+            print("[foodlion] saved store session not confirmed; selecting the store again")
+            STATE_PATH.unlink(missing_ok=True)
+            have_state = False
+
+        # Try to ensure ZIP is set so deals load; the session is only saved
+        # once the store is confirmed, so a missed probe is retried next run.
+        if not have_state:
+            try:
+                if await _set_zip_and_select_store(page):
+                    STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+                    await context.storage_state(path=str(STATE_PATH))
+                else:
+                    print("[foodlion] ZIP/store setup warning: store not confirmed; session not saved")
+            except Exception as e:
+                print(f"[foodlion] ZIP/store setup warning: {e}")
 
         # Nudge lazy-loaded content
         await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-        await page.wait_for_timeout(1500)
+        await _settle_after_scroll(page)
 
         html = await page.content()
+    finally:
         await context.close()
-        await browser.close()
-    return _extract_deals_from_html(html)
+    return _extract_deals_from_html(html), html
+
+async def fetch_foodlion_deals_async(browser=None) -> tuple:
+    """
+    Render the weekly ad and return (deals, rendered HTML). Reuses browser
+    when given; otherwise attaches to $PLAYWRIGHT_SOCKET (a running
+    `playwright launch-server`) or launches Chromium for this call.
+    """
+    if browser is not None:
+        return await _render_ad(browser)
+    async with async_playwright() as p:
+        socket = os.environ.get("PLAYWRIGHT_SOCKET")
+        if socket:
+            browser = await p.chromium.connect(socket)
+        else:
+            browser = await p.chromium.launch(headless=True, executable_path=_find_chromium())
+        try:
+            return await _render_ad(browser)
+        finally:
+            # for a connected browser this only disconnects
+            await browser.close()
 
 # scrapers/foodlion.py (only this function needs replacing)
 async def run_and_save_async() -> int:
     debug_path = OUT_PATH.parent / "debug_foodlion.html"
+    html = None
     try:
-        items = await fetch_foodlion_deals_async()
-        # Save last-rendered HTML for inspection if nothing parsed
-        # (fetch_foodlion_deals_async returns the HTML via internal call; adjust to return both if needed)
+        # The debug snapshot is the same HTML the deals were parsed from.
+        items, html = await fetch_foodlion_deals_async()
     except Exception as e:
         print(f"[foodlion] Error: {e}")
         items = []
 
-    # If you want to always keep a snapshot from the last run, change the scraper to return html too.
-    # Quick workaround: call the renderer again and save its content only for debugging:
-    try:
-        from playwright.async_api import async_playwright
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            context = await browser.new_context(
-                user_agent=("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-                            "AppleWebKit/537.36 (KHTML, like Gecko) "
-                            "Chrome/120.0.0.0 Safari/537.36"),
-                locale="en-US",
-            )
-            page = await context.new_page()
-            await page.goto(AD_URL, wait_until="networkidle", timeout=45000)
-            # try to set ZIP/store again quickly (non-fatal if fails)
-            try:
-                await _set_zip_and_select_store(page)
-            except Exception as e:
-                print(f"[foodlion] ZIP/store setup warning (debug snapshot): {e}")
-            await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-            await page.wait_for_timeout(800)
-            html = await page.content()
-            await context.close()
-            await browser.close()
-
-        debug_path.parent.mkdir(parents=True, exist_ok=True)
-        with debug_path.open("w", encoding="utf-8") as f:
-            f.write(html)
-        print(f"[foodlion] Wrote debug HTML -> {debug_path}")
-    except Exception as e:
-        print(f"[foodlion] Failed to write debug HTML: {e}")
+    if html is not None:
+        try:
+            debug_path.parent.mkdir(parents=True, exist_ok=True)
+            with debug_path.open("w", encoding="utf-8") as f:
+                f.write(html)
+            print(f"[foodlion] Wrote debug HTML -> {debug_path}")
+        except Exception as e:
+            print(f"[foodlion] Failed to write debug HTML: {e}")
 
     OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with OUT_PATH.open("w", encoding="utf-8") as f:
-        json.dump(items, f, ensure_ascii=False, indent=2)
+    jsonio.write_atomic(OUT_PATH, jsonio.dumps(items))
     print(f"[foodlion] Saved {len(items)} items -> {OUT_PATH}")
     return len(items)
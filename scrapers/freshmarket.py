@@ -1,9 +1,9 @@
 # scrapers/freshmarket.py
 import re
-import json
 from pathlib import Path
 from datetime import datetime, timedelta
-from bs4 import BeautifulSoup
+from utils import jsonio
+from utils.htmlscan import parse_html, scan_cards, stripped_text
 
 # Fresh Market "Weekly Features" page (marketing page, markup may change)
 AD_URL = "https://www.thefreshmarket.com/features/weekly-features"
@@ -11,6 +11,14 @@ OUT_PATH = Path(__file__).resolve().parents[1] / "data" / "deals_freshmarket.jso
 
 
 # ---------- Price & unit parsing helpers ----------
+_MULTI_FOR_RE = re.compile(r"(\d+)\s*(?:for|/\s*for)\s*\$?\s*([0-9]+(?:\.[0-9]{1,2})?)", re.I)
+_PRICE_RE = re.compile(r"\$?\s*([0-9]+(?:\.[0-9]{1,2})?)")
+_CENTS_RE = re.compile(r"([0-9]+)\s*¢")
+# "$" prices are read right after the sign: str.find locates it and the
+# regex only ever sees this many characters from there.
+_PRICE_WINDOW = 24
+
+
 def _parse_price(text: str):
     """
     Extract a single comparable item price from text.
@@ -25,39 +33,49 @@ def _parse_price(text: str):
     t = text.replace("\u00a0", " ")
 
     # e.g., "2 for $5", "3 for $10"
-    m = re.search(r"(\d+)\s*(?:for|/\s*for)\s*\$?\s*([0-9]+(?:\.[0-9]{1,2})?)", t, re.I)
+    m = _MULTI_FOR_RE.search(t)
     if m:
         qty = int(m.group(1))
         total = float(m.group(2))
         if qty > 0:
             return round(total / qty, 2)
 
-    # e.g., "$5.99", "$ 5", "5.99/lb"
-    m = re.search(r"\$?\s*([0-9]+(?:\.[0-9]{1,2})?)", t)
-    if m:
-        try:
+    # e.g., "$5.99", "$ 5"
+    idx = t.find("$")
+    while idx >= 0:
+        m = _PRICE_RE.match(t, idx, idx + _PRICE_WINDOW)
+        if m:
             return float(m.group(1))
-        except Exception:
-            pass
+        idx = t.find("$", idx + 1)
 
     # e.g., "99¢"
-    m = re.search(r"([0-9]+)\s*¢", t)
-    if m:
-        try:
+    if "¢" in t:
+        m = _CENTS_RE.search(t)
+        if m:
             return float(m.group(1)) / 100.0
-        except Exception:
-            pass
+
+    # e.g., "5.99/lb"
+    m = _PRICE_RE.search(t)
+    if m:
+        return float(m.group(1))
 
     return None
 
 
-_UNIT_PATTERNS = [
+_UNIT_PATTERNS = tuple((re.compile(pat), unit) for pat, unit in (
     (r"(\d+(?:\.\d+)?)\s*(oz)\b", "oz"),
     (r"(\d+(?:\.\d+)?)\s*(lb|lbs)\b", "lb"),
     (r"(\d+(?:\.\d+)?)\s*(ct|count)\b", "ct"),
     (r"(\d+(?:\.\d+)?)\s*(pk|pack|pkg)\b", "ct"),
-]
-_SIZE_HINTS = ["per lb", "lb", "oz", "dozen", "each", "ea", "ct", "pk", "pack"]
+))
+_DOZEN_RE = re.compile(r"\bdozen\b")
+_EACH_RE = re.compile(r"\b(each|ea)\b")
+_PER_LB_RE = re.compile(r"\b(per\s*lb|lb)\b")
+# Size hints in priority order; one alternation finds them all in a single
+# pass and the best-ranked hit wins (same result as trying them in order).
+_SIZE_HINTS = ("per lb", "lb", "oz", "dozen", "each", "ea", "ct", "pk", "pack")
+_SIZE_HINT_RANK = {h: i for i, h in enumerate(_SIZE_HINTS)}
+_SIZE_HINT_RE = re.compile(r"\b(" + "|".join(re.escape(h) for h in _SIZE_HINTS) + r")\b", re.I)
 
 
 def _extract_unit_info(text: str):
@@ -71,7 +89,7 @@ def _extract_unit_info(text: str):
 
     # explicit qty + unit (e.g., "32 oz", "1 lb", "12 ct")
     for pat, unit in _UNIT_PATTERNS:
-        m = re.search(pat, t)
+        m = pat.search(t)
         if m:
             try:
                 return float(m.group(1)), unit
@@ -79,96 +97,109 @@ def _extract_unit_info(text: str):
                 pass
 
     # "dozen" ~ 12 ct
-    if re.search(r"\bdozen\b", t):
+    if _DOZEN_RE.search(t):
         return 12.0, "ct"
 
     # "each"/"ea" → 1 ct
-    if re.search(r"\b(each|ea)\b", t):
+    if _EACH_RE.search(t):
         return 1.0, "ct"
 
     # unit-only hints (e.g., "per lb")
-    if re.search(r"\b(per\s*lb|lb)\b", t):
+    if _PER_LB_RE.search(t):
         return None, "lb"
 
     return None, None
 
 
+def _size_hint(text: str):
+    """First of _SIZE_HINTS (in list order) that appears as a word in text, or None."""
+    ranks = [_SIZE_HINT_RANK[m.group(1).lower()] for m in _SIZE_HINT_RE.finditer(text)]
+    return _SIZE_HINTS[min(ranks)] if ranks else None
+
+
 # ---------- HTML extraction ----------
+# Card-like containers, most specific first: likely real product tiles,
+# then a fallback sweep over generic blocks.
+_CARD_CLASSES = frozenset({"c-card", "card", "grid__item", "product", "product-card", "tile", "teaser", "feature"})
+_CARD_TAGS = frozenset({"article", "li", "div", "section"})
+_CARD_PASSES = (
+    lambda el: bool(_CARD_CLASSES.intersection((el.get("class") or "").split())),
+    lambda el: el.tag in _CARD_TAGS,
+)
+# Title-ish nodes inside a card (h1-h4, strong, .title, .card__title, ...)
+_TITLE_TAGS = frozenset({"h1", "h2", "h3", "h4", "strong"})
+_TITLE_CLASSES = frozenset({"title", "card__title", "product__title", "teaser__title"})
+
+
+def _is_title(el) -> bool:
+    return el.tag in _TITLE_TAGS or bool(_TITLE_CLASSES.intersection((el.get("class") or "").split()))
+
+
 def _extract_deals_from_html(html: str) -> list:
     """
     Heuristic parser that scans common Fresh Market marketing card structures.
     Tune/expand selectors based on what's saved in /debug_freshmarket.html.
+    Each price goes to the smallest card that yields an item.
     """
-    soup = BeautifulSoup(html or "", "lxml")
+    root = parse_html(html)
     items = []
-
-    # Most TFM marketing blocks render into card-like containers.
-    card_selectors = [
-        # more specific, likely real product tiles
-        ".c-card, .card, .grid__item, .product, .product-card, .tile, .teaser, .feature",
-        # fallback sweep
-        "article, li, div, section",
-    ]
-
     seen = set()
-
-    for sel in card_selectors:
-        for card in soup.select(sel):
-            txt = " ".join((card.get_text(" ", strip=True) or "").split())
-            if "$" not in txt and "¢" not in txt:
-                continue
-
-            price = _parse_price(txt)
-            if price is None:
-                continue
-
-            # Prefer explicit title-ish nodes; fallback to text before first $/¢.
-            name = None
-            for tag in card.select("h1,h2,h3,h4,strong,.title,.card__title,.product__title,.teaser__title"):
-                t = tag.get_text(" ", strip=True)
-                if t and "$" not in t and "¢" not in t and len(t) > 2:
-                    name = t
-                    break
-            if not name:
-                if "$" in txt:
-                    name = txt.split("$", 1)[0].strip()
-                elif "¢" in txt:
-                    name = txt.split("¢", 1)[0].strip()
-                else:
-                    name = txt
-                if len(name) < 3:
-                    continue
-
-            # Size hint string (for readability) + numeric unit extraction (for comparison)
-            size_text = None
-            for unit_hint in _SIZE_HINTS:
-                if re.search(rf"\b{re.escape(unit_hint)}\b", txt, re.I):
-                    size_text = unit_hint
-                    break
-            unit_qty, unit = _extract_unit_info(txt)
-
-            key = (name.lower(), float(price))
-            if key in seen:
-                continue
-            seen.add(key)
-
-            now = datetime.utcnow()
-            items.append({
-                "store_id": "fresh-market-24503",
-                "item": name[:120],
-                "size_text": size_text or "",
-                "price": float(price),
-                "unit_qty": unit_qty,
-                "unit": unit,
-                "start_date": now.date().isoformat(),
-                "end_date": (now + timedelta(days=7)).date().isoformat(),
-                "promo_text": "Weekly Features",
-                "source": AD_URL,
-                "fetched_at": now.isoformat() + "Z",
-            })
-
+    # one timestamp per page; every item from it shares the same dates
+    now = datetime.utcnow()
+    start_date = now.date().isoformat()
+    end_date = (now + timedelta(days=7)).date().isoformat()
+    fetched_at = now.isoformat() + "Z"
+
+    def card(el, txt, priced):
+        price = _parse_price(txt)
+        if price is None:
+            return False
+
+        # Prefer explicit title-ish nodes; fallback to text before first $/¢.
+        name = None
+        for tag in el.iterdescendants():
+            if tag in priced or not isinstance(tag.tag, str) or not _is_title(tag):
+                continue  # price text ($/¢) or not title-ish
+            t = stripped_text(tag)
+            if len(t) > 2:
+                name = t
+                break
+        if not name:
+            idx = txt.find("$")
+            if idx < 0:
+                idx = txt.find("¢")
+            name = txt[:idx].rstrip() if idx >= 0 else txt
+            if len(name) < 3:
+                return False
+
+        # Size hint string (for readability) + numeric unit extraction (for comparison)
+        size_text = _size_hint(txt)
+        unit_qty, unit = _extract_unit_info(txt)
+
+        key = (name[:120].lower(), float(price))
+        if key in seen:
+            return True
+        seen.add(key)
+
+        items.append({
+            "store_id": "fresh-market-24503",
+            "item": name[:120],
+            "size_text": size_text or "",
+            "price": float(price),
+            "unit_qty": unit_qty,
+            "unit": unit,
+            "start_date": start_date,
+            "end_date": end_date,
+            "promo_text": "Weekly Features",
+            "source": AD_URL,
+            "fetched_at": fetched_at,
+        })
+        return True
+
+    for is_card in _CARD_PASSES:
+        scan_cards(root, is_card, card, markers=("$", "¢"))
         if items:
-            break  # stop after first selector that produced data
+            break  # stop after first pass that produced data
 
     return items
 
@@ -183,5 +214,5 @@ def _parse_saved_debug_html_to_json(debug_html_path: Path = None) -> int:
     html = debug_html_path.read_text(encoding="utf-8", errors="ignore")
     items = _extract_deals_from_html(html)
     OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
-    OUT_PATH.write_text(json.dumps(items, ensure_ascii=False, indent=2), encoding="utf-8")
+    jsonio.write_atomic(OUT_PATH, jsonio.dumps(items))
     return len(items)
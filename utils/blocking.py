@@ -0,0 +1,25 @@
+import re
+
+# Nothing the scrapers mine comes from these; scripts and XHR stay on
+# because the ad pages render their tiles (and __NEXT_DATA__) from JS.
+BLOCKED_RESOURCE_TYPES = frozenset({"image", "font", "media", "stylesheet"})
+# A debug screenshot is only useful with images and CSS, so it keeps those.
+SCREENSHOT_BLOCKED_RESOURCE_TYPES = frozenset({"media"})
+# Analytics/ad beacons, dropped whatever the resource type.
+TRACKER_HOST_RE = re.compile(
+    r"^https?://(?:[^/]+\.)?(?:googletagmanager\.com|google-analytics\.com|doubleclick\.net"
+    r"|googlesyndication\.com|facebook\.net|hotjar\.com|segment\.io|newrelic\.com"
+    r"|nr-data\.net|bing\.com|pinterest\.com|tiktok\.com|criteo\.com)(?::\d+)?/",
+    re.I,
+)
+
+
+def resource_blocker(blocked_types=BLOCKED_RESOURCE_TYPES):
+    """Route handler for context.route("**/*", ...) that aborts blocked_types and tracker hosts."""
+    async def handler(route):
+        req = route.request
+        if req.resource_type in blocked_types or TRACKER_HOST_RE.match(req.url):
+            await route.abort()
+        else:
+            await route.continue_()
+    return handler
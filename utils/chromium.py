@@ -0,0 +1,28 @@
+import os
+
+# Where the Render build (or Playwright's default cache) puts Chromium.
+CHROMIUM_BASES = ("/opt/render/project/src/.playwright", "/opt/render/.cache/ms-playwright")
+
+_found = None
+
+
+def find_chromium_executable():
+    """
+    Newest chromium-*/chrome-linux/chrome under CHROMIUM_BASES, or None.
+    The install doesn't move while the process is up, so the first hit is reused.
+    """
+    global _found
+    if _found is not None:
+        return _found
+    for base in CHROMIUM_BASES:
+        try:
+            with os.scandir(base) as it:
+                names = [e.name for e in it if e.name.startswith("chromium-")]
+        except OSError:
+            continue
+        hits = [os.path.join(base, n, "chrome-linux", "chrome") for n in names]
+        hits = [h for h in hits if os.path.exists(h)]
+        if hits:
+            _found = max(hits)
+            return _found
+    return None
@@ -0,0 +1,76 @@
+import lxml.html
+from lxml import etree
+
+# Comments are dropped by the parser and these subtrees before the walk, so
+# itertext() only ever sees visible text.
+_INVISIBLE_TAGS = ("script", "style", "template")
+# Page HTML is fed to the parser in slices of this many characters.
+_FEED_CHUNK = 64 * 1024
+
+
+def parse_html(html: str):
+    """lxml document for a page's HTML (None for an empty page)."""
+    if not html or not html.strip():
+        return None
+    # Fed as UTF-8 bytes (lxml rejects str input carrying an XML encoding
+    # declaration), one slice at a time so the page is never held twice.
+    # A feed parser keeps state, hence one per call.
+    parser = lxml.html.HTMLParser(encoding="utf-8", remove_comments=True, remove_pis=True)
+    for i in range(0, len(html), _FEED_CHUNK):
+        parser.feed(html[i:i + _FEED_CHUNK].encode("utf-8", "ignore"))
+    root = parser.close()
+    etree.strip_elements(root, *_INVISIBLE_TAGS, with_tail=False)
+    return root
+
+
+def stripped_text(el) -> str:
+    """Like BeautifulSoup's get_text(" ", strip=True)."""
+    return " ".join(s.strip() for s in el.itertext() if s.strip())
+
+
+def flat_text(el) -> str:
+    """Subtree text with every whitespace run collapsed to one space."""
+    return " ".join(" ".join(el.itertext()).split())
+
+
+def scan_cards(root, is_card, extract, markers=("$",)):
+    """
+    One bottom-up pass over the tree. extract(el, text, priced) is tried on
+    card elements (is_card(el)) whose subtree holds a price marker that no
+    descendant card has already claimed; a truthy return claims them.
+    priced is the set of elements seen so far whose text has any marker,
+    claimed or not, so a title search can skip them without building
+    their text.
+
+    So each price is handled by the smallest card that turns it into an
+    item, and wrappers around already-parsed cards are skipped without
+    ever materialising their text.
+    """
+    if root is None:
+        return
+    priced = set()
+    # unclaimed marker counts of the children seen so far, per open element
+    stack = [0]
+    for event, el in etree.iterwalk(root, events=("start", "end")):
+        if event == "start":
+            stack.append(0)
+            continue
+        count = stack.pop()
+        # text directly inside el (its own text + the tails of its children)
+        direct = el.text or ""
+        has = False
+        for ch in el:
+            if ch.tail:
+                direct += ch.tail
+            if ch in priced:
+                has = True
+        for m in markers:
+            n = direct.count(m)
+            if n:
+                count += n
+                has = True
+        if has:
+            priced.add(el)
+        if count and is_card(el) and extract(el, flat_text(el), priced):
+            count = 0
+        stack[-1] += count
@@ -0,0 +1,42 @@
+import json
+import os
+import tempfile
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback keeps everything working without the wheel
+    orjson = None
+
+
+def loads(data):
+    """Parse JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumps(obj, default=None, sort_keys=False) -> bytes:
+    """Serialize to UTF-8 JSON bytes (non-ASCII characters are kept as-is)."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=default, option=option)
+    return json.dumps(obj, ensure_ascii=False, sort_keys=sort_keys, default=default).encode("utf-8")
+
+def write_atomic(path, data: bytes):
+    """
+    Write bytes to path via a temp file in the same directory + os.replace,
+    so readers see either the old file or the complete new one.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+    try:
+        os.fchmod(fd, 0o644)  # mkstemp creates 0600; keep data files world-readable
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise